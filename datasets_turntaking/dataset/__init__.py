@@ -5,7 +5,8 @@ DIALOG_AUDIO_FEATURES = {
     "dataset": Value("string"),
     "session": Value("string"),
     "audio_path": Value("string"),
-    "vad_list": [[Sequence(Value("float"))]],
+    # channel -> segment -> (start, end)
+    "vad_list": Sequence(Sequence(Sequence(Value("float32")))),
     "dialog": [
         Sequence(
             {
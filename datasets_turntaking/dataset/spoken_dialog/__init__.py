@@ -33,15 +33,23 @@ def load_switchboard(
     omit_backchannels=False,
     min_word_vad_diff=0.05,
     num_proc=None,
+    parse_workers=None,
     load_from_cache_file=True,
     format_turns=False,
+    streaming=False,
     **kwargs
 ):
     if split == "val":
         split = "validation"
 
-    swb_kwargs = {"min_word_vad_diff": min_word_vad_diff}
-    dset = load_dataset(DSET_PATHS["switchboard"], split=split, **swb_kwargs)
+    # `parse_workers`: processes used to parse the transcripts (None -> cpu_count)
+    swb_kwargs = {
+        "min_word_vad_diff": min_word_vad_diff,
+        "parse_workers": parse_workers,
+    }
+    dset = load_dataset(
+        DSET_PATHS["switchboard"], split=split, streaming=streaming, **swb_kwargs
+    )
 
     if format_turns:
         num_proc = num_proc if num_proc is not None else cpu_count()
@@ -68,6 +76,7 @@ def load_fisher(
     word_level_root=None,
     min_word_vad_diff=0.05,
     format_turns=False,
+    streaming=False,
 ):
     if split == "val":
         split = "validation"
@@ -76,7 +85,9 @@ def load_fisher(
     if word_level_root is not None:
         fisher_kwargs["word_level_root"] = word_level_root
 
-    dset = load_dataset(DSET_PATHS["fisher"], split=split, **fisher_kwargs)
+    dset = load_dataset(
+        DSET_PATHS["fisher"], split=split, streaming=streaming, **fisher_kwargs
+    )
     if format_turns:
         num_proc = num_proc if num_proc is not None else cpu_count()
         dset = dset.map(
@@ -93,8 +104,10 @@ def load_fisher(
     return dset
 
 
-def load_vacation_interview(split="train"):
-    return load_dataset(DSET_PATHS["vacation_interview"], split="train")
+def load_vacation_interview(split="train", streaming=False):
+    return load_dataset(
+        DSET_PATHS["vacation_interview"], split="train", streaming=streaming
+    )
 
 
 def load_callhome(split="train"):
@@ -1,17 +1,27 @@
-from os.path import join, expanduser
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from os.path import join, expanduser, exists
 from typing import List
 import datasets
+import hashlib
+import inspect
+import json
+import multiprocessing
+import numpy as np
 import os
+import pyarrow as pa
+import tempfile
 
 from datasets_turntaking.dataset import DIALOG_AUDIO_FEATURES
+from datasets_turntaking.dataset.spoken_dialog.switchboard import utils as swb_utils
 from datasets_turntaking.dataset.spoken_dialog.switchboard.utils import (
     load_transcript,
     extract_vad_list_from_words,
-    remove_words_from_dialog,
 )
 from datasets_turntaking.utils import (
     read_txt,
     read_json,
+    write_json,
     repo_root,
 )
 
@@ -27,6 +37,21 @@ SPLIT_PATH = os.path.join(
 )
 
 
+@lru_cache(maxsize=1)
+def _sess_to_rel_path():
+    """session -> relative audio path (the file is shipped with the repo)"""
+    return read_json(REL_AUDIO_PATH)
+
+
+FEATURES = datasets.Features(DIALOG_AUDIO_FEATURES)
+# Tables are built directly in the arrow layout of FEATURES so that neither
+# the `datasets` writer nor the cache below needs any per-example encoding.
+SCHEMA = FEATURES.arrow_schema
+TABLE_BATCH_SIZE = 256
+# config kwargs that do not change the data (excluded from the config id)
+NON_DATA_KWARGS = ("parse_workers",)
+
+
 _HOMEPAGE = "https://catalog.ldc.upenn.edu/LDC97S62"
 _URL = "https://www.isip.piconepress.com/projects/switchboard/releases/switchboard_word_alignments.tar.gz"
 _DESCRIPTION = """
@@ -50,20 +75,131 @@ _CITATION = """
 """
 
 
+def _build_one(
+    session,
+    audio_path,
+    extracted_path,
+    min_word_vad_diff,
+    remove_restarts,
+):
+    """Processes the transcript of a single session (run in worker processes)"""
+    session_dir = join(extracted_path, "swb_ms98_transcriptions", session[:2], session)
+
+    dialog = load_transcript(
+        session,
+        session_dir,
+        apply_regexp=True,
+        remove_restarts=remove_restarts,
+    )
+    vad = extract_vad_list_from_words(dialog, min_word_vad_diff)
+    # omit words. Sequence of dict: utterances -> dict of lists (per channel)
+    dialog = [
+        {
+            "start": np.array([utt["start"] for utt in channel], dtype=np.float32),
+            "end": np.array([utt["end"] for utt in channel], dtype=np.float32),
+            "text": [utt["text"] for utt in channel],
+        }
+        for channel in dialog
+    ]
+    return f"{session}", {
+        "session": session,
+        "dataset": "switchboard",
+        "audio_path": audio_path,
+        "vad_list": vad,
+        "dialog": dialog,
+    }
+
+
+@lru_cache(maxsize=1)
+def _preprocess_code_hash():
+    """
+    Hash of the code that produces the cached tables (transcript parsing,
+    vad extraction and table conversion) so that any change rebuilds the cache
+    """
+    md5 = hashlib.md5(inspect.getsource(swb_utils).encode())
+    for fn in (_build_one, _vad_list_array, _dialog_array, _examples_to_table):
+        md5.update(inspect.getsource(fn).encode())
+    return md5.hexdigest()
+
+
+def _offsets(lengths):
+    """List offsets from lengths: [0, l0, l0 + l1, ...]"""
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int32)
+    np.cumsum(lengths, out=offsets[1:])
+    return pa.array(offsets)
+
+
+def _vad_list_array(examples):
+    """
+    The `vad_list` column (example -> channel -> segment -> (start, end))
+    built from the flat float32 values (no per-segment python objects)
+    """
+    vads = [vad for example in examples for vad in example["vad_list"]]
+    values = np.concatenate(vads).ravel().astype(np.float32, copy=False)
+    segments = pa.ListArray.from_arrays(
+        _offsets(np.full(len(values) // 2, 2)), pa.array(values)
+    )
+    channels = pa.ListArray.from_arrays(_offsets([len(v) for v in vads]), segments)
+    return pa.ListArray.from_arrays(
+        _offsets([len(example["vad_list"]) for example in examples]), channels
+    )
+
+
+def _dialog_array(examples):
+    """
+    The `dialog` column (example -> channel -> struct of start/end/text lists)
+    built from the flat values of all channels
+    """
+    channels = [channel for example in examples for channel in example["dialog"]]
+    utterances = _offsets([len(channel["text"]) for channel in channels])
+    dialog_type = SCHEMA.field("dialog").type.value_type
+    utts = pa.StructArray.from_arrays(
+        [
+            pa.ListArray.from_arrays(
+                utterances, pa.array(np.concatenate([c["start"] for c in channels]))
+            ),
+            pa.ListArray.from_arrays(
+                utterances, pa.array(np.concatenate([c["end"] for c in channels]))
+            ),
+            pa.ListArray.from_arrays(
+                utterances,
+                pa.array([t for c in channels for t in c["text"]], type=pa.string()),
+            ),
+        ],
+        fields=list(dialog_type),
+    )
+    return pa.ListArray.from_arrays(
+        _offsets([len(example["dialog"]) for example in examples]), utts
+    )
+
+
+def _examples_to_table(examples):
+    """Builds a table (with SCHEMA) from a list of examples"""
+    columns = {
+        name: pa.array([example[name] for example in examples], type=pa.string())
+        for name in ("dataset", "session", "audio_path")
+    }
+    columns["vad_list"] = _vad_list_array(examples)
+    columns["dialog"] = _dialog_array(examples)
+    return pa.Table.from_pydict(columns, schema=SCHEMA)
+
+
 class SwitchboardConfig(datasets.BuilderConfig):
     def __init__(
         self,
         root=join(expanduser("~"), "projects/data/switchboard/audio"),
-        train_sessions=read_txt(os.path.join(SPLIT_PATH, "train.txt")),
-        val_sessions=read_txt(os.path.join(SPLIT_PATH, "val.txt")),
-        test_sessions=read_txt(os.path.join(SPLIT_PATH, "test.txt")),
+        train_sessions=None,  # None -> files/train.txt
+        val_sessions=None,  # None -> files/val.txt
+        test_sessions=None,  # None -> files/test.txt
         min_word_vad_diff: float = 0.1,
         remove_restarts: bool = False,  # "h-" -> "" if True
         ext=".wav",
+        parse_workers=None,  # processes used to parse transcripts (None -> cpu_count)
         **kwargs,
     ):
         super(SwitchboardConfig, self).__init__(**kwargs)
         self.ext = ext
+        self.parse_workers = parse_workers
         self.root = root
         self.min_word_vad_diff = min_word_vad_diff
         self.remove_restarts = remove_restarts
@@ -71,8 +207,31 @@ class SwitchboardConfig(datasets.BuilderConfig):
         self.val_sessions = val_sessions
         self.test_sessions = test_sessions
 
+    # NON_DATA_KWARGS (e.g. the number of workers) do not change the data:
+    # same config id (cache directory) and equal to the predefined config
+    def create_config_id(self, config_kwargs, custom_features=None) -> str:
+        config_kwargs = {
+            k: v for k, v in config_kwargs.items() if k not in NON_DATA_KWARGS
+        }
+        return super().create_config_id(config_kwargs, custom_features)
 
-class Swithchboard(datasets.GeneratorBasedBuilder):
+    def __eq__(self, o):
+        def data_attributes(config):
+            return {
+                k: v for k, v in config.__dict__.items() if k not in NON_DATA_KWARGS
+            }
+
+        return type(self) is type(o) and data_attributes(self) == data_attributes(o)
+
+    def get_sessions(self, split):
+        """The sessions of `split`. Defaults are read on demand (not on import)"""
+        sessions = getattr(self, f"{split}_sessions")
+        if sessions is None:
+            sessions = read_txt(os.path.join(SPLIT_PATH, f"{split}.txt"))
+        return sessions
+
+
+class Swithchboard(datasets.ArrowBasedBuilder):
     VERSION = datasets.Version("0.0.1")
     DEFAULT_CONFIG_NAME = "default"
     BUILDER_CONFIG_CLASS = SwitchboardConfig
@@ -88,59 +247,163 @@ class Swithchboard(datasets.GeneratorBasedBuilder):
             description=_DESCRIPTION,
             homepage=_HOMEPAGE,
             citation=_CITATION,
-            features=datasets.Features(DIALOG_AUDIO_FEATURES),
+            features=FEATURES,
             supervised_keys=None,
         )
 
     def _split_generators(self, dl_manager) -> List[datasets.SplitGenerator]:
+        if isinstance(dl_manager, datasets.StreamingDownloadManager):
+            # the transcripts are parsed from the extracted archive (and
+            # cached) up front, there is nothing to gain from streaming
+            raise NotImplementedError(
+                "Switchboard does not support `streaming=True`. "
+                "Load it with `streaming=False` (the audio is local anyway)."
+            )
         self.extracted_path = dl_manager.download_and_extract(_URL)  # hash
         return [
             datasets.SplitGenerator(
                 name=datasets.Split.TRAIN,
-                gen_kwargs={"sessions": self.config.train_sessions},
+                gen_kwargs={
+                    "sessions": self.config.get_sessions("train"),
+                    "split": "train",
+                },
             ),
             datasets.SplitGenerator(
                 name=datasets.Split.VALIDATION,
-                gen_kwargs={"sessions": self.config.val_sessions},
+                gen_kwargs={
+                    "sessions": self.config.get_sessions("val"),
+                    "split": "val",
+                },
             ),
             datasets.SplitGenerator(
                 name=datasets.Split.TEST,
-                gen_kwargs={"sessions": self.config.test_sessions},
+                gen_kwargs={
+                    "sessions": self.config.get_sessions("test"),
+                    "split": "test",
+                },
             ),
         ]
 
-    def generate(self, sessions):
-        sess_2_rel_path = read_json(REL_AUDIO_PATH)
-        for session in sessions:
-            session = str(session)
-            audio_path = join(
-                self.config.root, sess_2_rel_path[session] + self.config.ext
-            )
-            session_dir = join(
-                self.extracted_path, "swb_ms98_transcriptions", session[:2], session
-            )
+    # Preprocessed (transcript -> vad/dialog) sessions are cached as Arrow files
+    # so that later builds do not have to parse the transcripts again.
+    @property
+    def _vad_cache_dir(self):
+        """Cache directory of the preprocessed sessions for the current config"""
+        return join(
+            datasets.config.HF_DATASETS_CACHE,
+            "switchboard_preprocessed",
+            f"vad_diff_{self.config.min_word_vad_diff}_restarts_{self.config.remove_restarts}",
+        )
+
+    def _cache_hash(self, sessions):
+        """Hash of everything the cached examples depend on"""
+        conf = {
+            "version": str(self.VERSION),
+            "root": self.config.root,
+            "ext": self.config.ext,
+            "min_word_vad_diff": self.config.min_word_vad_diff,
+            "remove_restarts": self.config.remove_restarts,
+            "sessions": [str(s) for s in sessions],
+            "schema": SCHEMA.to_string(show_schema_metadata=False),
+            "code": _preprocess_code_hash(),
+        }
+        return hashlib.md5(json.dumps(conf, sort_keys=True).encode()).hexdigest()
 
-            dialog = load_transcript(
-                session,
-                session_dir,
-                apply_regexp=True,
-                remove_restarts=self.config.remove_restarts,
+    def _is_cached(self, cache_path, sessions):
+        sidecar = cache_path.replace(".arrow", ".json")
+        if not (exists(cache_path) and exists(sidecar)):
+            return False
+        return read_json(sidecar).get("config_hash") == self._cache_hash(sessions)
+
+    def _load_cached(self, cache_path):
+        """Memory-maps the cached Arrow file and yields its record batches"""
+        source = pa.memory_map(cache_path, "r")
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield pa.Table.from_batches([reader.get_batch(i)])
+
+    def _write_cached(self, cache_path, sessions, tables):
+        """
+        Passes through `tables` while writing them to `cache_path`.
+        The tables are written to a unique temporary file (concurrent builders
+        may process the same sessions) which is only moved into place (and the
+        sidecar written) once all sessions are processed.
+        """
+        os.makedirs(self._vad_cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self._vad_cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            with pa.ipc.new_file(tmp_path, SCHEMA) as writer:
+                for table in tables:
+                    writer.write_table(table)
+                    yield table
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            # e.g. an error or the generator is closed before finishing
+            if exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        write_json(
+            {"config_hash": self._cache_hash(sessions)},
+            cache_path.replace(".arrow", ".json"),
+        )
+
+    def _batch_tables(self, examples):
+        """Groups the processed examples into tables of TABLE_BATCH_SIZE rows"""
+        batch = []
+        for _, example in examples:
+            batch.append(example)
+            if len(batch) >= TABLE_BATCH_SIZE:
+                yield _examples_to_table(batch)
+                batch = []
+        if len(batch) > 0:
+            yield _examples_to_table(batch)
+
+    def _process_sessions(self, sessions):
+        sessions = [str(session) for session in sessions]
+        sess_2_rel_path = _sess_to_rel_path()
+        full_paths = {
+            session: join(self.config.root, sess_2_rel_path[session] + self.config.ext)
+            for session in sessions
+        }
+        build_one = partial(
+            _build_one,
+            extracted_path=self.extracted_path,
+            min_word_vad_diff=self.config.min_word_vad_diff,
+            remove_restarts=self.config.remove_restarts,
+        )
+        paths = [full_paths[session] for session in sessions]
+        num_proc = self.config.parse_workers or os.cpu_count()
+        if num_proc == 1 or multiprocessing.current_process().daemon:
+            # daemonic processes (e.g. DataLoader workers) can't have children
+            yield from map(build_one, sessions, paths)
+            return
+
+        with ProcessPoolExecutor(max_workers=num_proc) as executor:
+            yield from executor.map(
+                build_one,
+                sessions,
+                paths,
+                chunksize=32,
             )
-            vad = extract_vad_list_from_words(dialog, self.config.min_word_vad_diff)
-            # omit words
-            dialog = remove_words_from_dialog(dialog)
-            yield f"{session}", {
-                "session": session,
-                "dataset": "switchboard",
-                "audio_path": audio_path,
-                "vad_list": vad,
-                "dialog": dialog,
-            }
 
-    def _generate_examples(self, sessions):
+    def generate(self, sessions, split):
+        # the hash in the name keeps different session lists (custom splits,
+        # shards) from overwriting each other
+        cache_path = join(
+            self._vad_cache_dir, f"{split}_{self._cache_hash(sessions)}.arrow"
+        )
+        if self._is_cached(cache_path, sessions):
+            logger.info("Switchboard loading cached %s tables: %s", split, cache_path)
+            return self._load_cached(cache_path)
+        tables = self._batch_tables(self._process_sessions(sessions))
+        return self._write_cached(cache_path, sessions, tables)
+
+    def _generate_tables(self, sessions, split):
         logger.info(
             "Switchboard generating %s examples: %s",
             len(sessions),
             sessions[:5] + ["..."],
         )
-        return self.generate(sessions)
+        for idx, table in enumerate(self.generate(sessions, split)):
+            yield idx, table
@@ -1,5 +1,7 @@
 from os.path import join
 from os import walk
+from itertools import islice
+import numpy as np
 import re
 
 from datasets_turntaking.utils import read_txt
@@ -129,21 +131,50 @@ def extract_vad_list(anno):
     return vad
 
 
+def round_2(x: np.ndarray) -> np.ndarray:
+    """
+    Vectorized `round(x, 2)` with the exact values of python's `round`
+    (`np.round` scales by 100 first and e.g. rounds 4.785 -> 4.79 where
+    python gives 4.78). Only values close to a tie use python's `round`.
+    """
+    scaled = x * 100
+    out = np.rint(scaled) / 100
+    tie = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    if tie.any():
+        out[tie] = [round(v, 2) for v in x[tie].tolist()]
+    return out
+
+
 def extract_vad_list_from_words(anno, min_word_diff=0.05):
-    vad = [[], []]
+    """
+    Joins the words of each utterance into vad-segments if the pause between
+    consecutive words is shorter than `min_word_diff`. Segments never span
+    over utterance boundaries.
+
+    RETURN:
+        vad:    list of two np.float32 arrays (one per channel) of shape
+                (n_segments, 2) holding the segment start/end times
+    """
+    vad = []
     for channel in [0, 1]:
+        # flat [start, end, start, end, ...] in a single pass over the words
+        bounds = []
+        append = bounds.append
         for utt in anno[channel]:
-            s, e = utt["words"][0]["start"], utt["words"][0]["end"]
-            for w in utt["words"][1:]:
-                if w["start"] - e < min_word_diff:
+            words = utt["words"]
+            s, e = words[0]["start"], words[0]["end"]
+            for w in islice(words, 1, None):
+                start = w["start"]
+                if start - e < min_word_diff:
                     e = w["end"]
-                    # print('joint')
                 else:
-                    vad[channel].append((round(s, 2), round(e)))
-                    # update
-                    s = w["start"]
-                    e = w["end"]
-            vad[channel].append((round(s, 2), round(e, 2)))
+                    append(s)
+                    append(e)
+                    s, e = start, w["end"]
+            append(s)
+            append(e)
+        bounds = round_2(np.array(bounds, dtype=np.float64))
+        vad.append(bounds.astype(np.float32).reshape(-1, 2))
     return vad
 
 
@@ -1,6 +1,6 @@
 from os import environ, makedirs
 from os.path import join, exists
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset
 from typing import Any, Callable, Dict, Optional, List, Tuple, Union
 from tqdm import tqdm
 import torch
@@ -40,15 +40,23 @@ Source: https://github.com/pytorch/pytorch/issues/13246#issuecomment-905703662
 """
 
 
-def load_spoken_dialog_audio_dataset(datasets: List[str], split: str, **kwargs):
+def load_spoken_dialog_audio_dataset(
+    datasets: List[str], split: str, streaming: bool = False, **kwargs
+):
     dset = []
     for dataset in datasets:
         if dataset == "fisher":
-            dset.append(load_fisher(split=split, format_turns=False, **kwargs))
+            dset.append(
+                load_fisher(
+                    split=split, format_turns=False, streaming=streaming, **kwargs
+                )
+            )
         elif dataset == "switchboard":
-            dset.append(load_switchboard(split=split, format_turns=False))
+            dset.append(
+                load_switchboard(split=split, format_turns=False, streaming=streaming)
+            )
         elif dataset == "vacation_interview":
-            dset.append(load_vacation_interview(split=split))
+            dset.append(load_vacation_interview(split=split, streaming=streaming))
     assert (
         len(dset) > 0
     ), f"Must load at least one dataset ['fisher', 'switchboard']. Got {datasets}"
@@ -529,6 +537,16 @@ class DialogAudioDataset(Dataset):
     def __len__(self) -> int:
         return len(self.map_to_dset_idx)
 
+    def get_lengths(self) -> torch.Tensor:
+        """Number of waveform samples of every item (audio is not loaded)"""
+        if self.dset_type != "full":
+            return torch.full((len(self),), self.n_samples, dtype=torch.long)
+
+        durations = torch.tensor(
+            [get_audio_info(path)["duration"] for path in self.dataset["audio_path"]]
+        )
+        return (durations[self.map_to_dset_idx] * self.sample_rate).long()
+
     def get_dialog_sample(self, idx) -> Dict[str, Any]:
         d = self.dataset[idx]
         return self.get_sample(d)
@@ -599,10 +617,13 @@ class DialogAudioDataset(Dataset):
         """
         dset_idx = self.map_to_dset_idx[idx].item()
         start_time = self.map_to_start_time[idx].item()
+        return self.get_item(self.dataset[dset_idx], start_time)
+
+    def get_item(self, b, start_time: float) -> Dict[str, Any]:
+        """The (augmented) sample of dialog `b` starting at `start_time`"""
         end_time = (
             None if self.dset_type == "full" else start_time + self.audio_duration
         )
-        b = self.dataset[dset_idx]
         d = self.get_sample(b, start_time, end_time)
 
         if self.mask_vad and torch.rand(1) <= self.mask_vad_probability:
@@ -625,6 +646,39 @@ class DialogAudioDataset(Dataset):
         return d
 
 
+class DialogAudioIterableDataset(DialogAudioDataset, IterableDataset):
+    """
+    DialogAudioDataset over a streaming huggingface `IterableDataset`.
+
+    The dialogs are never materialized so the sample maps can't be computed
+    up front. Instead the samples of each dialog are yielded as it is
+    streamed. Only the `sliding` and `full` types are supported and the
+    dataset has no length.
+    """
+
+    def get_sample_maps(self, type: str = "sliding") -> Tuple[None, None]:
+        assert type in (
+            "sliding",
+            "full",
+        ), f"Streaming only supports type 'sliding' or 'full'. Got {type}"
+        return None, None
+
+    def __len__(self) -> int:
+        raise TypeError("DialogAudioIterableDataset (streaming) has no length")
+
+    def get_start_times(self, b) -> List[float]:
+        if self.dset_type == "full":
+            return [0]
+        duration = get_audio_info(b["audio_path"])["duration"]
+        n_clips = int((duration - self.audio_duration) / self.audio_step_time + 1)
+        return torch.arange(0, duration, self.audio_step_time)[:n_clips].tolist()
+
+    def __iter__(self):
+        for b in self.dataset:
+            for start_time in self.get_start_times(b):
+                yield self.get_item(b, start_time)
+
+
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
     from datasets_turntaking.features.plot_utils import plot_batch_sample
@@ -1,13 +1,15 @@
 from os import cpu_count
 from os.path import join
-from typing import Any, Callable, List, Optional
+from typing import Any, Callable, Iterator, List, Optional
 
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Sampler
 import pytorch_lightning as pl
 import torch
+import torch.distributed as dist
 
 from datasets_turntaking.dialog_audio_dataset import (
     DialogAudioDataset,
+    DialogAudioIterableDataset,
     load_spoken_dialog_audio_dataset,
 )
 from datasets_turntaking.utils import repo_root, OmegaConfArgs, load_config
@@ -16,6 +18,179 @@ from datasets_turntaking.utils import repo_root, OmegaConfArgs, load_config
 DEFAULT_CONFIG = join(repo_root(), "config/dset_dialog_audio.yaml")
 
 
+class CudaPrefetcher:
+    """
+    Wraps a DataLoader and copies the next batch to the GPU on a separate
+    cuda-stream (non_blocking) while the current batch is being processed.
+    Requires `pin_memory=True` for the copies to be asynchronous.
+
+    Opt-in (`DialogAudioDM(cuda_prefetch=True)`) and single-device only:
+    * Lightning only injects its `DistributedSampler` into real DataLoaders,
+      so under DDP every rank would iterate over the entire dataset.
+    * Batches are moved to the *current* cuda device, regardless of the
+      device/accelerator the Trainer uses.
+
+    If `flip_probability` > 0 the channels/speakers of each sample are
+    flipped on the GPU with that probability (as `transforms.FlipBatch`).
+    """
+
+    def __init__(self, loader: DataLoader, flip_probability: float = 0.0):
+        self.loader = loader
+        self.flip_probability = flip_probability
+        self.stream = torch.cuda.Stream()
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+    def __getattr__(self, name: str) -> Any:
+        # forward e.g. `dataset`, `batch_size`, `sampler` to the DataLoader
+        if name == "loader":
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+    def preload(self, it):
+        try:
+            batch = next(it)
+        except StopIteration:
+            return None
+
+        with torch.cuda.stream(self.stream):
+            batch = {
+                k: v.cuda(non_blocking=True) if torch.is_tensor(v) else v
+                for k, v in batch.items()
+            }
+            if self.flip_probability > 0:
+                batch = self.flip(batch, self.flip_probability)
+        return batch
+
+    @staticmethod
+    def flip(batch, flip_probability: float = 0.5):
+        """
+        Flips the channels of a random subset of the batch (no host sync).
+        Equal to `transforms.FlipBatch` for the flipped samples.
+        """
+        ref = next(v for v in batch.values() if torch.is_tensor(v))
+        flip = torch.rand(ref.shape[0], device=ref.device) < flip_probability
+
+        def where(x: torch.Tensor, flipped: torch.Tensor) -> torch.Tensor:
+            mask = flip.view(-1, *[1] * (x.ndim - 1))
+            return torch.where(mask, flipped, x)
+
+        if "waveform" in batch and batch["waveform"].shape[1] == 2:
+            batch["waveform"] = where(batch["waveform"], batch["waveform"].flip(1))
+
+        if "vad" in batch:
+            batch["vad"] = where(batch["vad"], batch["vad"].flip(-1))
+
+        if "vad_history" in batch:
+            batch["vad_history"] = where(batch["vad_history"], 1 - batch["vad_history"])
+        return batch
+
+    def __iter__(self):
+        it = iter(self.loader)
+        batch = self.preload(it)
+        while batch is not None:
+            current_stream = torch.cuda.current_stream()
+            current_stream.wait_stream(self.stream)
+            for v in batch.values():
+                if torch.is_tensor(v):
+                    v.record_stream(current_stream)
+            next_batch = self.preload(it)
+            yield batch
+            batch = next_batch
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Groups items of similar length (`lengths // bucket_width`) into the same
+    batches to minimize the padding of variable length samples.
+    Items are shuffled within each bucket and the batch order is shuffled
+    (seeded by `seed` + epoch, see `set_epoch`).
+
+    Distributed: the batches are sharded over `num_replicas` (default: the
+    world size of `torch.distributed`) and every rank gets the same number of
+    batches. Lightning can't rebuild this sampler with its own
+    DistributedSampler, so use `Trainer(use_distributed_sampler=False)`
+    (`replace_sampler_ddp=False` in older versions).
+    """
+
+    def __init__(
+        self,
+        lengths: torch.Tensor,
+        batch_size: int,
+        bucket_width: int,
+        shuffle: bool = True,
+        drop_last: bool = False,
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+        seed: int = 0,
+    ):
+        distributed = dist.is_available() and dist.is_initialized()
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if distributed else 1
+        if rank is None:
+            rank = dist.get_rank() if distributed else 0
+        assert 0 <= rank < num_replicas, f"Invalid rank {rank} ({num_replicas})"
+
+        self.lengths = torch.as_tensor(lengths)
+        self.batch_size = batch_size
+        self.bucket_width = max(int(bucket_width), 1)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+
+        bucket_ids = torch.div(self.lengths, self.bucket_width, rounding_mode="floor")
+        self.buckets = [
+            torch.where(bucket_ids == b)[0] for b in bucket_ids.unique().tolist()
+        ]
+
+    def set_epoch(self, epoch: int) -> None:
+        """Different shuffling each epoch (identical over all ranks)"""
+        self.epoch = epoch
+
+    def get_batches(self) -> List[List[int]]:
+        """All batches (over all ranks)"""
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = bucket[torch.randperm(len(bucket), generator=g)]
+            for batch in bucket.split(self.batch_size):
+                if self.drop_last and len(batch) < self.batch_size:
+                    continue
+                batches.append(batch.tolist())
+
+        if self.shuffle:
+            perm = torch.randperm(len(batches), generator=g).tolist()
+            batches = [batches[i] for i in perm]
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self.get_batches()
+        if len(batches) == 0:
+            return iter([])
+
+        # repeat batches so that every rank gets `len(self)` batches
+        total = len(self) * self.num_replicas
+        while len(batches) < total:
+            batches += batches[: total - len(batches)]
+        return iter(batches[self.rank : total : self.num_replicas])
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            n_batches = sum(len(b) // self.batch_size for b in self.buckets)
+        else:
+            n_batches = sum(
+                (len(b) + self.batch_size - 1) // self.batch_size for b in self.buckets
+            )
+        return (n_batches + self.num_replicas - 1) // self.num_replicas
+
+
 class DialogAudioDM(pl.LightningDataModule):
     def __init__(
         self,
@@ -40,8 +215,11 @@ class DialogAudioDM(pl.LightningDataModule):
         mask_vad: bool = False,
         mask_vad_probability: float = 0.5,
         batch_size: int = 4,
-        num_workers: int = 0,
+        num_workers: Optional[int] = 0,  # None -> cpu_count()
         pin_memory: bool = True,
+        cuda_prefetch: bool = False,  # single-device only, see `CudaPrefetcher`
+        bucket_by_length: bool = False,  # DDP: see `BucketBatchSampler`
+        streaming: bool = False,
         transforms: Optional[Callable] = None,
     ):
         super().__init__()
@@ -81,16 +259,45 @@ class DialogAudioDM(pl.LightningDataModule):
         # DataLoder
         self.batch_size = batch_size
         self.pin_memory = pin_memory
-        self.num_workers = num_workers
+        # more workers than this rarely helps and only adds memory/spawn overhead
+        if num_workers is None:
+            num_workers = cpu_count()
+        self.num_workers = min(num_workers or 0, 8, cpu_count() or 1)
+        self.cuda_prefetch = cuda_prefetch
+        self.bucket_by_length = bucket_by_length
+
+        # Stream the huggingface datasets instead of building them up front
+        self.streaming = streaming
+
+        # loaded huggingface datasets (split -> dataset)
+        self._cached_dsets = {}
+
+    @property
+    def _use_cuda_prefetch(self) -> bool:
+        return self.cuda_prefetch and torch.cuda.is_available()
+
+    @property
+    def _pin_in_collate(self) -> bool:
+        """
+        Allocate the batch in pinned memory directly in `collate_fn`.
+        Only in the main process: tensors from worker processes are moved to
+        (unpinned) shared memory which would undo the pinning.
+        """
+        return self.pin_memory and self.num_workers == 0 and torch.cuda.is_available()
 
     def _dataset(self, dset, split="train"):
         # Only flip during training...
+        # (on the GPU in `CudaPrefetcher` if `cuda_prefetch=True` and cuda is
+        # available, otherwise per sample in the dataset)
         if split == "train":
-            flip = self.flip_channels
+            flip = self.flip_channels and not self._use_cuda_prefetch
         else:
             flip = False
 
-        return DialogAudioDataset(
+        dataset_class = (
+            DialogAudioIterableDataset if self.streaming else DialogAudioDataset
+        )
+        return dataset_class(
             dataset=dset,
             feature_extractor=None,
             type=self.type,
@@ -122,97 +329,138 @@ class DialogAudioDM(pl.LightningDataModule):
 
         To avoid the `datasets` logging warnings set `DATASETS_VERBOSITY=error` in your terminal ENV.
         """
+        if self.streaming:
+            # nothing to prepare, the data is streamed in `setup`
+            return
+
         for split in ["train", "validation", "test"]:
-            _ = load_spoken_dialog_audio_dataset(datasets=self.datasets, split=split)
+            _ = self._load(split)
+
+    def _load(self, split: str):
+        """
+        Loads the (concatenated) huggingface dataset of `split` once and
+        reuses it for later calls from `prepare_data` and `setup`.
+        """
+        if split == "val":
+            split = "validation"
+
+        if split not in self._cached_dsets:
+            self._cached_dsets[split] = load_spoken_dialog_audio_dataset(
+                datasets=self.datasets, split=split, streaming=self.streaming
+            )
+        return self._cached_dsets[split]
 
     def setup(self, stage: Optional[str] = "fit"):
         """Loads the datasets"""
 
         if stage in (None, "fit"):
-            train_hf_dataset = load_spoken_dialog_audio_dataset(
-                datasets=self.datasets,
-                split="train",
-            )
-            self.train_dset = self._dataset(train_hf_dataset, split="train")
-            val_hf_dataset = load_spoken_dialog_audio_dataset(
-                datasets=self.datasets,
-                split="val",
-            )
-            self.val_dset = self._dataset(val_hf_dataset, split="val")
+            self.train_dset = self._dataset(self._load("train"), split="train")
+            self.val_dset = self._dataset(self._load("val"), split="val")
+            self.train_sampler = self._bucket_sampler(self.train_dset, shuffle=True)
+            self.val_sampler = self._bucket_sampler(self.val_dset, shuffle=False)
 
         if stage in (None, "test"):
-            test_hf_dataset = load_spoken_dialog_audio_dataset(
-                datasets=self.datasets,
-                split="test",
-            )
-            self.test_dset = self._dataset(test_hf_dataset, split="test")
+            self.test_dset = self._dataset(self._load("test"), split="test")
+            self.test_sampler = self._bucket_sampler(self.test_dset, shuffle=False)
+
+    def _bucket_sampler(self, dset, shuffle):
+        """Length-bucketed batches (only matters for variable length samples)"""
+        if not self.bucket_by_length or self.streaming:
+            return None
+        return BucketBatchSampler(
+            dset.get_lengths(),
+            batch_size=self.batch_size,
+            bucket_width=self.audio_duration * self.sample_rate / 10,
+            shuffle=shuffle,
+        )
 
     def collate_fn(self, batch):
-        waveforms = []
-        vad = []
-        vad_history = []
-        vad_label = []
-        dset_names = []
-        sessions = []
-        for b in batch:
-            waveforms.append(b["waveform"])
-            dset_names.append(b["dataset"])
-            sessions.append(b["session"])
-
-            if "vad" in b:
-                vad.append(b["vad"])
-
-            if "vad_history" in b:
-                vad_history.append(b["vad_history"])
-
-            if "vad_label" in b:
-                vad_label.append(b["vad_label"])
-
+        """
+        Stacks the samples directly into preallocated tensors (fast-collate)
+        instead of gathering lists and concatenating them.
+        Each sample tensor has a leading batch dimension of 1. Samples of
+        different lengths are zero-padded to the longest one.
+        The batch is allocated in pinned memory if `self._pin_in_collate`.
+        """
         ret = {
-            "waveform": torch.cat(waveforms),
-            "dset_name": dset_names,
-            "session": sessions,
+            "dset_name": [b["dataset"] for b in batch],
+            "session": [b["session"] for b in batch],
         }
-        if len(vad) > 0:
-            ret["vad"] = torch.cat(vad)
-
-        if len(vad_history) > 0:
-            ret["vad_history"] = torch.cat(vad_history)
-
-        if len(vad_label) > 0:
-            ret["vad_label"] = torch.cat(vad_label)
-
+        pin_memory = self._pin_in_collate
+        for key in ["waveform", "vad", "vad_history", "vad_label"]:
+            if key not in batch[0]:
+                continue
+            samples = [b[key][0] for b in batch]  # omit the sample batch dim
+            shapes = [x.shape for x in samples]
+            dtype = samples[0].dtype
+            if all(shape == shapes[0] for shape in shapes):
+                out = torch.empty(
+                    (len(batch), *shapes[0]), dtype=dtype, pin_memory=pin_memory
+                )
+                ret[key] = torch.stack(samples, dim=0, out=out)
+            else:
+                # variable length samples (e.g. type='full') are zero-padded
+                shape = [max(dims) for dims in zip(*shapes)]
+                ret[key] = torch.zeros(
+                    (len(batch), *shape), dtype=dtype, pin_memory=pin_memory
+                )
+                for i, x in enumerate(samples):
+                    ret[key][i][tuple(slice(0, n) for n in x.shape)].copy_(x)
         return ret
 
+    def _worker_kwargs(self):
+        """Keep workers alive between epochs (only valid with num_workers > 0)"""
+        if self.num_workers > 0:
+            return {"persistent_workers": True, "prefetch_factor": 2}
+        return {}
+
+    def _batch_kwargs(self, sampler, shuffle):
+        if sampler is not None:
+            return {"batch_sampler": sampler}
+        if self.streaming:
+            # iterable datasets can't be shuffled by the DataLoader
+            shuffle = False
+        return {"batch_size": self.batch_size, "shuffle": shuffle}
+
+    def _prefetch(self, loader: DataLoader, flip: bool = False):
+        """Overlap host->device copies with compute if a GPU is available"""
+        if self._use_cuda_prefetch:
+            flip_probability = self.flip_probability if flip else 0.0
+            return CudaPrefetcher(loader, flip_probability=flip_probability)
+        return loader
+
     def train_dataloader(self):
-        return DataLoader(
+        loader = DataLoader(
             self.train_dset,
-            batch_size=self.batch_size,
-            pin_memory=self.pin_memory,
+            pin_memory=self.pin_memory and not self._pin_in_collate,
             collate_fn=self.collate_fn,
             num_workers=self.num_workers,
-            shuffle=True,
+            **self._worker_kwargs(),
+            **self._batch_kwargs(self.train_sampler, shuffle=True),
         )
+        return self._prefetch(loader, flip=self.flip_channels)
 
     def val_dataloader(self):
-        return DataLoader(
+        loader = DataLoader(
             self.val_dset,
-            batch_size=self.batch_size,
-            pin_memory=self.pin_memory,
+            pin_memory=self.pin_memory and not self._pin_in_collate,
             collate_fn=self.collate_fn,
             num_workers=self.num_workers,
-            shuffle=False,
+            **self._worker_kwargs(),
+            **self._batch_kwargs(self.val_sampler, shuffle=False),
         )
+        return self._prefetch(loader)
 
     def test_dataloader(self):
-        return DataLoader(
+        loader = DataLoader(
             self.test_dset,
-            batch_size=self.batch_size,
-            pin_memory=self.pin_memory,
+            pin_memory=self.pin_memory and not self._pin_in_collate,
             collate_fn=self.collate_fn,
             num_workers=self.num_workers,
-            shuffle=False,
+            **self._worker_kwargs(),
+            **self._batch_kwargs(self.test_sampler, shuffle=False),
         )
+        return self._prefetch(loader)
 
     def __repr__(self):
         s = "DialogAudioDM"
@@ -228,6 +476,9 @@ class DialogAudioDM(pl.LightningDataModule):
         s += f"\n\tbatch_size: {self.batch_size}"
         s += f"\n\tpin_memory: {self.pin_memory}"
         s += f"\n\tnum_workers: {self.num_workers}"
+        s += f"\n\tcuda_prefetch: {self.cuda_prefetch}"
+        s += f"\n\tbucket_by_length: {self.bucket_by_length}"
+        s += f"\n\tstreaming: {self.streaming}"
 
         if hasattr(self, "train_dset"):
             s += "\n\t" + ("-" * 10) + "\n"
@@ -269,7 +520,8 @@ class DialogAudioDM(pl.LightningDataModule):
         parser = parent_parser.add_argument_group("ULMProjection")
         parser.add_argument("--data_conf", default=None, type=str)
         parser.add_argument("--batch_size", default=4, type=int)
-        parser.add_argument("--num_workers", default=cpu_count(), type=int)
+        # None -> cpu_count() (resolved in `DialogAudioDM.__init__`)
+        parser.add_argument("--num_workers", default=None, type=int)
         parser.add_argument("--train_files", default=None, type=str)
         parser.add_argument("--val_files", default=None, type=str)
         parser.add_argument("--test_files", default=None, type=str)
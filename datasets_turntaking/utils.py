@@ -9,6 +9,12 @@ import torch
 import torchaudio
 import torchaudio.functional as AF
 
+# optional: faster json parsing
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def samples_to_frames(s: int, hop_len: float) -> int:
     return int(s / hop_len)
@@ -106,6 +112,11 @@ def write_json(data, filename):
 
 
 def read_json(path, encoding="utf8"):
+    # orjson only parses utf-8
+    if orjson is not None and encoding.lower().replace("-", "") == "utf8":
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+
     with open(path, "r", encoding=encoding) as f:
         data = json.loads(f.read())
     return data
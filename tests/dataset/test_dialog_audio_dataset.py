@@ -0,0 +1,71 @@
+import pytest
+import torch
+import datasets
+
+import datasets_turntaking.dialog_audio_dataset as dialog_audio_dataset
+from datasets_turntaking.dialog_audio_dataset import (
+    DialogAudioDataset,
+    DialogAudioIterableDataset,
+)
+
+DURATIONS = {"a.wav": 35.0, "b.wav": 12.5, "c.wav": 10.0}
+
+
+def get_dialogs():
+    for session, path in enumerate(DURATIONS):
+        yield {"session": str(session), "audio_path": path}
+
+
+@pytest.fixture
+def fake_audio_info(monkeypatch):
+    monkeypatch.setattr(
+        dialog_audio_dataset,
+        "get_audio_info",
+        lambda path: {"duration": DURATIONS[path]},
+    )
+
+
+def get_iterable(monkeypatch, **kwargs):
+    dset = DialogAudioIterableDataset(
+        datasets.IterableDataset.from_generator(get_dialogs), **kwargs
+    )
+    monkeypatch.setattr(
+        dset,
+        "get_item",
+        lambda b, start_time: {"session": b["session"], "start": start_time},
+    )
+    return dset
+
+
+@pytest.mark.dataset
+@pytest.mark.parametrize("audio_duration, audio_overlap", [(10, 2), (5, 0), (4, 3)])
+def test_iterable_sliding(fake_audio_info, monkeypatch, audio_duration, audio_overlap):
+    kwargs = {"audio_duration": audio_duration, "audio_overlap": audio_overlap}
+    samples = list(get_iterable(monkeypatch, **kwargs))
+
+    # same samples as the (map-style) DialogAudioDataset
+    reference = DialogAudioDataset(
+        datasets.Dataset.from_list(list(get_dialogs())), **kwargs
+    )
+    assert [s["session"] for s in samples] == [
+        str(i) for i in reference.map_to_dset_idx.tolist()
+    ]
+    assert [s["start"] for s in samples] == pytest.approx(
+        reference.map_to_start_time.tolist()
+    )
+
+
+@pytest.mark.dataset
+def test_iterable_full(fake_audio_info, monkeypatch):
+    samples = list(get_iterable(monkeypatch, type="full"))
+    assert samples == [{"session": str(i), "start": 0} for i in range(len(DURATIONS))]
+
+
+@pytest.mark.dataset
+def test_iterable_unsupported(monkeypatch):
+    dset = get_iterable(monkeypatch)
+    with pytest.raises(TypeError):
+        len(dset)
+
+    with pytest.raises(AssertionError):
+        get_iterable(monkeypatch, type="ipu")
@@ -0,0 +1,171 @@
+import pytest
+import torch
+
+from datasets_turntaking import DialogAudioDM
+
+
+def get_sample(n_samples, n_channels=2, n_frames=10, dtype=torch.float32):
+    return {
+        "dataset": "switchboard",
+        "session": "2001",
+        "waveform": torch.rand((1, n_channels, n_samples)).to(dtype),
+        "vad": torch.randint(0, 2, (1, n_frames, 2)).to(dtype),
+    }
+
+
+@pytest.mark.dialog_audio_dm
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float64])
+def test_collate_equal_lengths(dtype):
+    dm = DialogAudioDM(datasets=["switchboard"])
+    batch = [get_sample(100, dtype=dtype) for _ in range(3)]
+    out = dm.collate_fn(batch)
+
+    assert out["waveform"].shape == (3, 2, 100)
+    assert out["vad"].shape == (3, 10, 2)
+    assert out["waveform"].dtype == dtype
+    assert out["vad"].dtype == dtype
+    assert out["session"] == ["2001"] * 3
+    assert out["dset_name"] == ["switchboard"] * 3
+    for i, b in enumerate(batch):
+        assert torch.equal(out["waveform"][i], b["waveform"][0])
+        assert torch.equal(out["vad"][i], b["vad"][0])
+
+
+@pytest.mark.dialog_audio_dm
+@pytest.mark.parametrize("n_channels", [1, 2])
+def test_collate_unequal_lengths(n_channels):
+    dm = DialogAudioDM(datasets=["switchboard"])
+    lengths = [80, 100, 60]
+    batch = [get_sample(n, n_channels=n_channels, n_frames=n // 10) for n in lengths]
+    out = dm.collate_fn(batch)
+
+    assert out["waveform"].shape == (3, n_channels, 100)
+    assert out["vad"].shape == (3, 10, 2)
+    for i, (n, b) in enumerate(zip(lengths, batch)):
+        assert torch.equal(out["waveform"][i, :, :n], b["waveform"][0])
+        assert (out["waveform"][i, :, n:] == 0).all(), "Expected zero padding"
+        assert torch.equal(out["vad"][i, : n // 10], b["vad"][0])
+        assert (out["vad"][i, n // 10 :] == 0).all(), "Expected zero padding"
+
+
+@pytest.mark.dialog_audio_dm
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires cuda")
+@pytest.mark.parametrize("lengths", [[100, 100], [80, 100]])
+def test_collate_pin_memory(lengths):
+    dm = DialogAudioDM(datasets=["switchboard"], pin_memory=True, num_workers=0)
+    out = dm.collate_fn([get_sample(n) for n in lengths])
+    assert out["waveform"].is_pinned()
+    assert out["vad"].is_pinned()
+
+
+@pytest.mark.dialog_audio_dm
+def test_dataloaders_are_dataloaders():
+    """Lightning only replaces the sampler (e.g. DDP) of real DataLoaders"""
+    from torch.utils.data import DataLoader, DistributedSampler
+    from pytorch_lightning.utilities.data import _update_dataloader
+
+    dm = DialogAudioDM(datasets=["switchboard"], batch_size=2)
+    dset = [get_sample(100) for _ in range(8)]
+    dm.train_dset, dm.val_dset, dm.test_dset = dset, dset, dset
+    dm.train_sampler, dm.val_sampler, dm.test_sampler = None, None, None
+
+    for loader in [dm.train_dataloader(), dm.val_dataloader(), dm.test_dataloader()]:
+        assert isinstance(loader, DataLoader)
+        sampler = DistributedSampler(dset, num_replicas=2, rank=0, shuffle=False)
+        loader = _update_dataloader(loader, sampler)
+        assert isinstance(loader.sampler, DistributedSampler)
+        assert sum(len(b["session"]) for b in loader) == len(dset) // 2
+
+
+LENGTHS = torch.tensor([100, 105, 310, 300, 102, 500, 305, 108, 101, 507, 302])
+
+
+@pytest.mark.dialog_audio_dm
+@pytest.mark.parametrize("shuffle", [True, False])
+@pytest.mark.parametrize("drop_last", [True, False])
+def test_bucket_sampler(shuffle, drop_last):
+    from datasets_turntaking.dialog_audio_dm import BucketBatchSampler
+
+    sampler = BucketBatchSampler(
+        LENGTHS, batch_size=2, bucket_width=100, shuffle=shuffle, drop_last=drop_last
+    )
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+
+    # buckets: 1xx -> 5 items, 3xx -> 4 items, 5xx -> 2 items
+    expected_batches = 2 + 2 + 1 if drop_last else 3 + 2 + 1
+    assert len(sampler) == expected_batches
+
+    for batch in batches:
+        buckets = (LENGTHS[batch] // 100).unique()
+        assert len(buckets) == 1, f"Expected batch from a single bucket {batch}"
+        if drop_last:
+            assert len(batch) == 2
+
+    indices = [i for batch in batches for i in batch]
+    assert len(indices) == len(set(indices))
+    if not drop_last:
+        assert sorted(indices) == list(range(len(LENGTHS)))
+
+
+@pytest.mark.dialog_audio_dm
+def test_bucket_sampler_epochs():
+    from datasets_turntaking.dialog_audio_dm import BucketBatchSampler
+
+    sampler = BucketBatchSampler(LENGTHS, batch_size=2, bucket_width=100)
+    first = list(sampler)
+    assert first == list(sampler), "Expected the same order within an epoch"
+    sampler.set_epoch(1)
+    assert list(sampler) != first, "Expected a new order for a new epoch"
+
+
+@pytest.mark.dialog_audio_dm
+@pytest.mark.parametrize("num_replicas", [2, 3, 8])
+def test_bucket_sampler_distributed(num_replicas):
+    from datasets_turntaking.dialog_audio_dm import BucketBatchSampler
+
+    samplers = [
+        BucketBatchSampler(
+            LENGTHS,
+            batch_size=2,
+            bucket_width=100,
+            num_replicas=num_replicas,
+            rank=rank,
+        )
+        for rank in range(num_replicas)
+    ]
+    rank_batches = [list(sampler) for sampler in samplers]
+
+    # same number of batches on every rank (or DDP hangs)
+    for sampler, batches in zip(samplers, rank_batches):
+        assert len(batches) == len(sampler) == len(samplers[0])
+
+    # all items are covered
+    indices = {i for batches in rank_batches for batch in batches for i in batch}
+    assert indices == set(range(len(LENGTHS)))
+
+
+@pytest.mark.dialog_audio_dm
+@pytest.mark.parametrize("channels", [1, 2])
+def test_prefetcher_flip(channels):
+    from datasets_turntaking.dialog_audio_dm import CudaPrefetcher
+    from datasets_turntaking.features.transforms import FlipBatch
+
+    batch = {
+        "waveform": torch.randn(4, channels, 160),
+        "vad": torch.randint(0, 2, (4, 10, 2)).float(),
+        "vad_history": torch.rand(4, 10, 5),
+        "dataset_name": ["switchboard"] * 4,
+    }
+    expected = FlipBatch()(
+        {k: v.clone() for k, v in batch.items() if k != "dataset_name"}
+    )
+    flipped = CudaPrefetcher.flip({k: v for k, v in batch.items()}, 1.0)
+    for k, v in expected.items():
+        assert torch.equal(flipped[k], v), f"{k} differs from FlipBatch"
+    assert flipped["dataset_name"] == batch["dataset_name"]
+
+    # nothing is flipped with p=0
+    unchanged = CudaPrefetcher.flip({k: v for k, v in batch.items()}, 0.0)
+    for k in ["waveform", "vad", "vad_history"]:
+        assert torch.equal(unchanged[k], batch[k])
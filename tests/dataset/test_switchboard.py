@@ -1,3 +1,8 @@
+from os import listdir, makedirs
+from os.path import join
+import datasets
+import numpy as np
+import pyarrow as pa
 import pytest
 from datasets_turntaking import DialogAudioDM
 
@@ -51,3 +56,208 @@ def test_dm(type, vad, vad_history, vad_hz, sample_rate):
                 break
     except Exception as e:
         assert False, inputs + f"Test dataloader broke {e}"
+
+
+def write_fake_transcripts(extracted_path, sessions):
+    """Minimal swb_ms98_transcriptions (word + utterance level) for `sessions`"""
+    for session in sessions:
+        session_dir = join(
+            extracted_path, "swb_ms98_transcriptions", session[:2], session
+        )
+        makedirs(session_dir)
+        for speaker in "AB":
+            utt = f"sw{session}{speaker}-ms98-a-0001"
+            with open(
+                join(session_dir, f"sw{session}{speaker}-ms98-a-word.text"), "w"
+            ) as f:
+                f.write(
+                    f"{utt} 0.5 0.8 hello\n{utt} 0.85 1.2 there\n{utt} 2.0 2.4 w[ent]\n"
+                )
+            with open(
+                join(session_dir, f"sw{session}{speaker}-ms98-a-trans.text"), "w"
+            ) as f:
+                f.write(f"{utt} 0.4 2.5 hello there w[ent]\n")
+
+
+@pytest.mark.switchboard
+def test_preprocessing_cache(tmp_path, monkeypatch):
+    from datasets_turntaking.dataset.spoken_dialog.switchboard.switchboard import (
+        Swithchboard,
+    )
+
+    sessions = ["2001", "2005"]
+    extracted_path = str(tmp_path / "extracted")
+    write_fake_transcripts(extracted_path, sessions)
+    monkeypatch.setattr(datasets.config, "HF_DATASETS_CACHE", str(tmp_path / "cache"))
+
+    def get_builder(**config_kwargs):
+        builder = Swithchboard(
+            cache_dir=str(tmp_path / "hf"), parse_workers=1, **config_kwargs
+        )
+        builder.extracted_path = extracted_path
+        return builder
+
+    def count_processed(builder):
+        calls = []
+        process_sessions = builder._process_sessions
+
+        def wrapper(sessions):
+            calls.append(sessions)
+            return process_sessions(sessions)
+
+        monkeypatch.setattr(builder, "_process_sessions", wrapper)
+        return calls
+
+    builder = get_builder()
+    calls = count_processed(builder)
+    first = pa.concat_tables(builder.generate(sessions, "train"))
+    assert len(calls) == 1
+    assert first.num_rows == len(sessions)
+
+    # second call reads the cache
+    second = pa.concat_tables(builder.generate(sessions, "train"))
+    assert len(calls) == 1, "Expected the cached tables to be used"
+    assert first.equals(second)
+
+    # different sessions and a changed config rebuild (without clobbering)
+    _ = pa.concat_tables(builder.generate(sessions[:1], "train"))
+    assert len(calls) == 2
+    _ = pa.concat_tables(builder.generate(sessions, "train"))
+    assert len(calls) == 2, "Expected the cache of all sessions to be kept"
+
+    builder = get_builder(root=str(tmp_path / "other_audio_root"))
+    calls = count_processed(builder)
+    rebuilt = pa.concat_tables(builder.generate(sessions, "train"))
+    assert len(calls) == 1, "Expected a changed config to rebuild the cache"
+    assert (
+        rebuilt["audio_path"][0].as_py().startswith(str(tmp_path / "other_audio_root"))
+    )
+
+    # the original cache is still valid
+    builder = get_builder()
+    calls = count_processed(builder)
+    _ = pa.concat_tables(builder.generate(sessions, "train"))
+    assert len(calls) == 0
+    assert not any(f.endswith(".tmp") for f in listdir(builder._vad_cache_dir))
+
+    # changed parsing code rebuilds
+    from datasets_turntaking.dataset.spoken_dialog.switchboard import switchboard
+
+    monkeypatch.setattr(switchboard, "_preprocess_code_hash", lambda: "changed")
+    builder = get_builder()
+    calls = count_processed(builder)
+    _ = pa.concat_tables(builder.generate(sessions, "train"))
+    assert len(calls) == 1, "Expected changed parsing code to rebuild the cache"
+
+
+@pytest.mark.switchboard
+def test_process_sessions_in_daemon(tmp_path, monkeypatch):
+    """DataLoader workers are daemonic and can't start a process pool"""
+    import multiprocessing
+    from datasets_turntaking.dataset.spoken_dialog.switchboard import switchboard
+
+    sessions = ["2001", "2005"]
+    extracted_path = str(tmp_path / "extracted")
+    write_fake_transcripts(extracted_path, sessions)
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError("Expected serial processing in a daemonic process")
+
+    builder = switchboard.Swithchboard(cache_dir=str(tmp_path / "hf"), parse_workers=4)
+    builder.extracted_path = extracted_path
+    monkeypatch.setattr(switchboard, "ProcessPoolExecutor", no_pool)
+    monkeypatch.setattr(multiprocessing.current_process(), "daemon", True)
+    processed = list(builder._process_sessions(sessions))
+    assert [key for key, _ in processed] == sessions
+
+
+@pytest.mark.switchboard
+def test_streaming_not_supported(tmp_path):
+    from datasets_turntaking.dataset.spoken_dialog.switchboard.switchboard import (
+        Swithchboard,
+    )
+
+    builder = Swithchboard(cache_dir=str(tmp_path / "hf"))
+    with pytest.raises(NotImplementedError, match="streaming"):
+        builder.as_streaming_dataset(split="train")
+
+
+@pytest.mark.switchboard
+def test_vad_list_array():
+    from datasets_turntaking.dataset.spoken_dialog.switchboard.switchboard import (
+        FEATURES,
+        _vad_list_array,
+    )
+
+    vad_lists = [
+        [np.array([[0.5, 1.2], [2.0, 2.4]]), np.zeros((0, 2))],
+        [np.array([[0.25, 3.0]]), np.array([[1.0, 1.5], [4.0, 4.5], [5.0, 6.0]])],
+    ]
+    examples = [
+        {"vad_list": [vad.astype(np.float32) for vad in vad_list]}
+        for vad_list in vad_lists
+    ]
+    array = _vad_list_array(examples)
+    assert array.type == FEATURES.arrow_schema.field("vad_list").type
+    assert array.to_pylist() == [
+        [vad.tolist() for vad in example["vad_list"]] for example in examples
+    ]
+
+
+@pytest.mark.switchboard
+def test_examples_to_table(tmp_path):
+    from datasets_turntaking.dataset.spoken_dialog.switchboard.switchboard import (
+        SCHEMA,
+        _build_one,
+        _examples_to_table,
+    )
+
+    sessions = ["2001", "2005"]
+    extracted_path = str(tmp_path / "extracted")
+    write_fake_transcripts(extracted_path, sessions)
+    examples = [
+        _build_one(session, f"{session}.wav", extracted_path, 0.1, False)[1]
+        for session in sessions
+    ]
+    # empty channel
+    examples[1]["vad_list"][1] = examples[1]["vad_list"][1][:0]
+    examples[1]["dialog"][1] = {k: v[:0] for k, v in examples[1]["dialog"][1].items()}
+
+    table = _examples_to_table(examples)
+    assert table.schema.equals(SCHEMA)
+
+    # same as the (slow) conversion of nested python lists
+    columns = {
+        name: [example[name] for example in examples]
+        for name in ("dataset", "session", "audio_path")
+    }
+    columns["vad_list"] = [
+        [vad.tolist() for vad in example["vad_list"]] for example in examples
+    ]
+    columns["dialog"] = [
+        [
+            {k: list(channel[k]) for k in ("start", "end", "text")}
+            for channel in example["dialog"]
+        ]
+        for example in examples
+    ]
+    assert table.equals(pa.Table.from_pydict(columns, schema=SCHEMA))
+    assert table["dialog"][0].as_py()[0]["text"] == ["hello there went"]
+
+
+@pytest.mark.switchboard
+def test_parse_workers_config_id(tmp_path):
+    """The number of workers should not change the cache directory"""
+    from datasets_turntaking.dataset.spoken_dialog.switchboard.switchboard import (
+        Swithchboard,
+    )
+
+    cache_dir = str(tmp_path / "hf")
+    default = Swithchboard(cache_dir=cache_dir, min_word_vad_diff=0.05)
+    workers = Swithchboard(cache_dir=cache_dir, min_word_vad_diff=0.05, parse_workers=3)
+    assert workers.config.parse_workers == 3
+    assert workers.config_id == default.config_id
+    assert workers.cache_dir == default.cache_dir
+
+    other = Swithchboard(cache_dir=cache_dir, min_word_vad_diff=0.2)
+    assert other.config_id != default.config_id
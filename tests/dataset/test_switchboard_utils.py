@@ -0,0 +1,136 @@
+import random
+import timeit
+
+import numpy as np
+import pytest
+
+from datasets_turntaking.dataset.spoken_dialog.switchboard.utils import (
+    extract_vad_list_from_words,
+    round_2,
+)
+
+
+def reference_vad_list_from_words(anno, min_word_diff=0.05):
+    """Per-word loop of the original implementation"""
+    vad = [[], []]
+    for channel in [0, 1]:
+        for utt in anno[channel]:
+            s, e = utt["words"][0]["start"], utt["words"][0]["end"]
+            for w in utt["words"][1:]:
+                if w["start"] - e < min_word_diff:
+                    e = w["end"]
+                else:
+                    vad[channel].append((round(s, 2), round(e, 2)))
+                    s = w["start"]
+                    e = w["end"]
+            vad[channel].append((round(s, 2), round(e, 2)))
+    return vad
+
+
+def utterance(*words):
+    return {"words": [{"start": s, "end": e} for s, e in words]}
+
+
+def assert_vad_equal(vad, ref):
+    for channel in [0, 1]:
+        assert vad[channel].dtype == np.float32
+        assert vad[channel].shape == (len(ref[channel]), 2)
+        expected = np.array(ref[channel], dtype=np.float32).reshape(-1, 2)
+        assert np.array_equal(vad[channel], expected), f"channel {channel}"
+
+
+@pytest.mark.switchboard
+def test_vad_list_empty_channel():
+    anno = [[utterance((0.5, 0.8), (0.82, 1.0))], []]
+    vad = extract_vad_list_from_words(anno, 0.1)
+    assert_vad_equal(vad, reference_vad_list_from_words(anno, 0.1))
+    assert vad[1].shape == (0, 2)
+
+
+@pytest.mark.switchboard
+def test_vad_list_single_word_utterances():
+    anno = [
+        [utterance((0.5, 0.8)), utterance((2.0, 2.5))],
+        [utterance((1.0, 1.234))],
+    ]
+    vad = extract_vad_list_from_words(anno, 0.1)
+    assert_vad_equal(vad, reference_vad_list_from_words(anno, 0.1))
+    assert np.allclose(vad[0], [[0.5, 0.8], [2.0, 2.5]])
+
+
+@pytest.mark.switchboard
+def test_vad_list_utterance_boundary():
+    # the pause between the utterances is below `min_word_diff` but segments
+    # never span across utterances
+    anno = [
+        [utterance((0.5, 0.8), (0.85, 1.0)), utterance((1.01, 1.5), (2.0, 2.5))],
+        [],
+    ]
+    vad = extract_vad_list_from_words(anno, 0.1)
+    assert_vad_equal(vad, reference_vad_list_from_words(anno, 0.1))
+    assert len(vad[0]) == 3
+
+
+@pytest.mark.switchboard
+def test_vad_list_random_dialogs():
+    rng = random.Random(0)
+    for _ in range(500):
+        anno = []
+        for _ in range(2):
+            t, utts = 0, []
+            for _ in range(rng.randint(0, 5)):
+                words = []
+                for _ in range(rng.randint(1, 6)):
+                    t += round(rng.random() * 0.2, 3)
+                    start = t
+                    t += round(rng.random() * 0.5, 3)
+                    words.append((start, t))
+                utts.append(utterance(*words))
+            anno.append(utts)
+        vad = extract_vad_list_from_words(anno, 0.1)
+        assert_vad_equal(vad, reference_vad_list_from_words(anno, 0.1))
+
+
+@pytest.mark.switchboard
+def test_round_2():
+    rng = random.Random(0)
+    values = [k / 1000 for k in range(100000)]  # all (near) ties up to 100s
+    values += [rng.random() * 1000 for _ in range(100000)]
+    values += [round(rng.random() * 1000, 6) for _ in range(100000)]
+    rounded = round_2(np.array(values))
+    assert rounded.tolist() == [round(v, 2) for v in values]
+
+
+def get_benchmark_dialog(max_words, n_utterances=150):
+    rng = random.Random(0)
+    anno = []
+    for _ in range(2):
+        t, utts = 0, []
+        for _ in range(n_utterances):
+            words = []
+            for _ in range(rng.randint(1, max_words)):
+                t += rng.random() * 0.1
+                start = t
+                t += rng.random() * 0.4
+                words.append((round(start, 6), round(t, 6)))
+            utts.append(utterance(*words))
+        anno.append(utts)
+    return anno
+
+
+@pytest.mark.switchboard
+@pytest.mark.parametrize("max_words", [3, 10, 40])
+def test_vad_list_benchmark(max_words):
+    """Must be faster than the per-word loop (including the numpy output)"""
+    anno = get_benchmark_dialog(max_words)
+    assert_vad_equal(
+        extract_vad_list_from_words(anno), reference_vad_list_from_words(anno)
+    )
+
+    def benchmark(f):
+        return min(timeit.repeat(lambda: f(anno), number=20, repeat=5)) / 20
+
+    new = benchmark(extract_vad_list_from_words)
+    ref = benchmark(reference_vad_list_from_words)
+    print(f"max_words={max_words}: {1e3 * ref:.2f} ms -> {1e3 * new:.2f} ms")
+    assert new < ref